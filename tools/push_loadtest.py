@@ -0,0 +1,317 @@
+"""微博推送扇出压测：合成大量群和订阅，用本地记录器代替 OneBot 发送，跑完整的检查周期并输出指标
+
+在 HoshinoBot 根目录下运行（需要能导入 hoshino / nonebot），不会访问微博，也不会读写插件目录里的数据文件：
+
+    python hoshino/modules/weibo/tools/push_loadtest.py --groups 2000 --uids 300 --subs-per-group 20
+
+插件会先复制到临时目录再导入，配置、抓取进度、存档等都写在临时目录里，运行结束后删除。
+抓取（fetch_user_posts）、登录探测、用户信息和九宫格合成都替换为本地的模拟实现，
+其余流程（检查流水线、订阅遍历、去重登记、合并转发、发送与 last_post_time 更新）使用插件原有代码。
+
+输出：送达吞吐（条/秒）、每轮检查耗时、内存峰值、事件循环延迟，以及应送达/实际送达/重复/注入失败的数量；
+--json 时额外输出一行 JSON，便于不同版本之间对比。
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_STATUS_RE = re.compile(r'm\.weibo\.cn/status/(\w+)')
+
+
+class RecordingBot:
+    """模拟 OneBot：记录每次发送，按设置注入延迟和失败"""
+
+    def __init__(self, latency, jitter, fail_rate, rng):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.rng = rng
+        self.delivered = collections.Counter()  # {(群号, 微博ID): 次数}
+        self.calls = 0
+        self.failures = 0
+
+    async def _call(self):
+        self.calls += 1
+        delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+        if delay:
+            await asyncio.sleep(delay)
+        if self.fail_rate and self.rng.random() < self.fail_rate:
+            self.failures += 1
+            raise RuntimeError('模拟发送失败')
+
+    def _record(self, group_id, message):
+        for post_id in _STATUS_RE.findall(message):
+            self.delivered[(str(group_id), post_id)] += 1
+
+    async def send_group_msg(self, group_id, message, **kwargs):
+        await self._call()
+        self._record(group_id, message)
+
+    async def send_group_forward_msg(self, group_id, messages, **kwargs):
+        await self._call()
+        for node in messages:
+            self._record(group_id, node['data']['content'])
+
+    async def send_private_msg(self, **kwargs):
+        pass
+
+    async def get_version_info(self):
+        return {'app_name': 'loadtest'}
+
+    async def get_login_info(self):
+        return {'user_id': 10000}
+
+
+class LoopLagMonitor:
+    """定时唤醒，记录实际唤醒时间比预期晚了多少"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+
+    def summary(self):
+        if not self.samples:
+            return {'max_ms': 0.0, 'p99_ms': 0.0, 'mean_ms': 0.0}
+        ordered = sorted(self.samples)
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        return {'max_ms': round(ordered[-1] * 1000, 1), 'p99_ms': round(p99 * 1000, 1),
+                'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2)}
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+def _parse_setting(text):
+    key, _, raw = text.partition('=')
+    if not raw:
+        raise argparse.ArgumentTypeError(f'设置项格式应为 key=value: {text}')
+    return key.strip(), raw.strip()
+
+
+def _import_plugin(workdir):
+    """复制插件到临时目录后导入，数据文件都落在临时目录"""
+    import nonebot
+    try:
+        nonebot.get_bot()
+    except Exception:
+        # 插件导入时注册 on_startup，需要 NoneBot 已初始化
+        nonebot.init()
+    shutil.copy(os.path.join(PLUGIN_DIR, 'weibo.py'), workdir)
+    sys.path.insert(0, workdir)
+    import weibo
+    return weibo
+
+
+def _patch_bot(weibo, bot):
+    import nonebot
+    import hoshino
+    nonebot.get_bot = lambda: bot
+    hoshino.get_bot = lambda: bot
+    with contextlib.suppress(AttributeError):
+        weibo.sv.bot = bot
+
+
+def build_config(weibo, args, rng):
+    """合成订阅：每个群随机订阅 subs_per_group 个UID"""
+    uids = [str(5000000000 + i) for i in range(args.uids)]
+    follows = {}
+    for g in range(args.groups):
+        group_id = str(100000 + g)
+        chosen = rng.sample(uids, min(args.subs_per_group, len(uids)))
+        follows[group_id] = {uid: weibo.Subscription(f'账号{uid[-4:]}', '2020-01-01 00:00:00') for uid in chosen}
+    with weibo.config_transaction() as draft:
+        draft['group_follows'].clear()
+        draft['group_follows'].update(follows)
+        draft['group_enable'].clear()
+        draft['settings'].update({'shard_enabled': False, 'home_feed_enabled': False,
+                                  'cycle_time_budget': 24 * 3600})
+        for key, raw in args.set:
+            if key not in weibo.DEFAULT_SETTINGS:
+                raise SystemExit(f'没有名为 {key} 的设置项')
+            default = weibo.DEFAULT_SETTINGS[key]
+            if isinstance(default, bool):
+                value = raw.lower() in ('on', 'true', '1')
+            elif isinstance(default, (int, float)):
+                value = type(default)(raw)
+            else:
+                value = raw
+            draft['settings'][key] = value
+        if args.digest:
+            for group_id in follows:
+                draft.group('group_options', group_id)['digest_threshold'] = args.digest
+    return uids, follows
+
+
+def install_fakes(weibo, args, round_state):
+    """替换所有会访问网络的部分"""
+    async def fetch_user_posts(uid):
+        if args.fetch_latency:
+            await asyncio.sleep(args.fetch_latency)
+        created = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        pics = [f'https://wx1.sinaimg.cn/large/lt{uid}{i}.jpg' for i in range(args.pics)]
+        return [weibo.WeiboPost(id=f'{uid}{round_state["round"]:03d}{i}', uid=uid, text=f'压测微博 {uid} #{i}',
+                                pics=pics, created_time=created) for i in range(args.posts_per_uid)]
+
+    async def fetch_user_info(uid, retry=2):
+        return {'name': f'压测{uid[-4:]}', 'uid': uid}
+
+    async def probe_credentials(force=False):
+        return True
+
+    async def merge_images_to_grid(pic_urls):
+        await asyncio.sleep(args.media_delay)
+        return '[CQ:image,file=base64://loadtest]'
+
+    weibo.fetch_user_posts = fetch_user_posts
+    weibo._fetch_weibo_user_info = fetch_user_info
+    weibo.probe_credentials = probe_credentials
+    weibo.merge_images_to_grid = merge_images_to_grid
+    weibo.GROUP_SEND_INTERVAL = args.send_interval
+    weibo._credential_pool.load([{'cookie': f'SUB=loadtest{i}', 'xsrf_token': ''} for i in range(args.fetchers)])
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='weibo_loadtest_')
+    try:
+        weibo = _import_plugin(workdir)
+        if not args.verbose:
+            weibo.sv.logger.setLevel(logging.CRITICAL)
+        bot = RecordingBot(args.latency, args.jitter, args.fail_rate, rng)
+        _patch_bot(weibo, bot)
+        await weibo.ensure_plugin_ready()
+
+        round_state = {'round': 0}
+        setup_started = time.perf_counter()
+        uids, follows = build_config(weibo, args, rng)
+        install_fakes(weibo, args, round_state)
+        setup_seconds = time.perf_counter() - setup_started
+
+        expected = sum(len(subs) for subs in follows.values()) * args.posts_per_uid
+        baseline_rss = _peak_rss_mb()
+        if args.tracemalloc:
+            tracemalloc.start()
+        monitor = LoopLagMonitor()
+        monitor.start()
+        cycle_times = []
+        for r in range(args.rounds):
+            round_state['round'] = r
+            if r:
+                # last_post_time 精确到秒，间隔一秒保证新一轮的微博比上一轮送达时间新
+                await asyncio.sleep(1.1)
+            started = time.perf_counter()
+            await weibo.check_and_push_new_weibo()
+            cycle_times.append(time.perf_counter() - started)
+        await monitor.stop()
+        traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        if args.tracemalloc:
+            tracemalloc.stop()
+
+        delivered = sum(1 for count in bot.delivered.values() if count)
+        duplicates = sum(count - 1 for count in bot.delivered.values() if count > 1)
+        total_time = sum(cycle_times)
+        report = {
+            'groups': args.groups, 'uids': args.uids, 'subscriptions': sum(len(s) for s in follows.values()),
+            'rounds': args.rounds, 'setup_s': round(setup_seconds, 2),
+            'cycle_s': [round(t, 2) for t in cycle_times],
+            'expected': expected * args.rounds, 'delivered': delivered, 'duplicates': duplicates,
+            'send_calls': bot.calls, 'injected_failures': bot.failures,
+            'throughput_per_s': round(delivered / total_time, 1) if total_time else 0.0,
+            'baseline_rss_mb': baseline_rss, 'peak_rss_mb': _peak_rss_mb(),
+            'traced_peak_mb': round(traced_peak / 1024 / 1024, 1) if traced_peak is not None else None,
+            'loop_lag': monitor.summary(),
+            'settings': {key: weibo.get_setting(key) for key in weibo.DEFAULT_SETTINGS if key.startswith('pipeline_')},
+        }
+        return report
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(report):
+    lag = report['loop_lag']
+    print(f"群 {report['groups']}，UID {report['uids']}，订阅 {report['subscriptions']}，共 {report['rounds']} 轮"
+          f"（合成配置 {report['setup_s']}s）")
+    print(f"每轮检查耗时: {', '.join(f'{t}s' for t in report['cycle_s'])}")
+    print(f"送达 {report['delivered']}/{report['expected']}，重复 {report['duplicates']}，"
+          f"发送调用 {report['send_calls']}，注入失败 {report['injected_failures']}")
+    print(f"送达吞吐: {report['throughput_per_s']} 条/秒")
+    memory = f"进程内存峰值: {report['peak_rss_mb']} MB（周期开始前 {report['baseline_rss_mb']} MB）"
+    if report['traced_peak_mb'] is not None:
+        memory += f"，tracemalloc 峰值 {report['traced_peak_mb']} MB"
+    print(memory)
+    print(f"事件循环延迟: 最大 {lag['max_ms']}ms，p99 {lag['p99_ms']}ms，平均 {lag['mean_ms']}ms")
+    print(f"流水线设置: {report['settings']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='微博推送扇出压测（模拟 OneBot，不访问微博）')
+    parser.add_argument('--groups', type=int, default=1000, help='群数量')
+    parser.add_argument('--uids', type=int, default=200, help='被订阅的微博账号数量')
+    parser.add_argument('--subs-per-group', type=int, default=10, help='每个群订阅的账号数')
+    parser.add_argument('--posts-per-uid', type=int, default=1, help='每个账号每轮的新微博数')
+    parser.add_argument('--rounds', type=int, default=1, help='检查轮数')
+    parser.add_argument('--fetchers', type=int, default=1, help='模拟的 Cookie 数量（决定抓取并发）')
+    parser.add_argument('--fetch-latency', type=float, default=0.05, help='模拟抓取耗时（秒）')
+    parser.add_argument('--pics', type=int, default=0, help='每条微博的图片数，3张及以上时走九宫格合成')
+    parser.add_argument('--media-delay', type=float, default=0.2, help='模拟九宫格合成耗时（秒）')
+    parser.add_argument('--latency', type=float, default=0.005, help='模拟 OneBot 每次发送的延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='发送延迟的随机抖动（秒）')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='发送失败的概率')
+    parser.add_argument('--send-interval', type=float, default=0.0,
+                        help='每次群发送后的间隔（插件默认 3 秒，压测默认 0）')
+    parser.add_argument('--digest', type=int, default=0, help='所有群开启合并推送的阈值，0 表示不开启')
+    parser.add_argument('--set', type=_parse_setting, action='append', default=[], metavar='KEY=VALUE',
+                        help='覆盖插件设置，如 --set pipeline_media_workers=4，可重复')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--tracemalloc', action='store_true', help='用 tracemalloc 统计 Python 分配峰值（会变慢）')
+    parser.add_argument('--json', action='store_true', help='额外输出一行 JSON')
+    parser.add_argument('--verbose', action='store_true', help='显示插件日志')
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()